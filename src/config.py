@@ -1,6 +1,6 @@
 """Configuration for available Cerebras models."""
 
-from typing import Dict, TypedDict
+from typing import Callable, Dict, Tuple, TypedDict
 
 class ModelConfig(TypedDict):
     name: str
@@ -28,4 +28,26 @@ MODELS: Dict[str, ModelConfig] = {
         "tokens": 8192,
         "developer": "Alibaba"
     }
-} 
+}
+
+# Derived lookups for the model selector and details panel. Built here rather than in the app script,
+# which Streamlit re-executes on every rerun, so they are created once per process.
+MODEL_IDS: Tuple[str, ...] = tuple(MODELS.keys())
+MODEL_LABELS: Dict[str, str] = {model_id: cfg["name"] for model_id, cfg in MODELS.items()}
+model_label: Callable[[str], str] = MODEL_LABELS.__getitem__
+MODEL_DETAILS_MD: Dict[str, str] = {
+    model_id: (
+        "**Model Details:**\n"
+        f"- **Name:** {cfg['name']}\n"
+        f"- **Max Tokens (Context):** {cfg['tokens']}\n"
+        f"- **Developer:** {cfg['developer']}"
+    )
+    for model_id, cfg in MODELS.items()
+}
+
+# Context tokens kept free for the model's reply when trimming the prompt,
+# and the resulting prompt budget per model
+RESERVED_OUTPUT_TOKENS = 1024
+MODEL_PROMPT_BUDGETS: Dict[str, int] = {
+    model_id: cfg["tokens"] - RESERVED_OUTPUT_TOKENS for model_id, cfg in MODELS.items()
+}
@@ -0,0 +1,79 @@
+"""SQLite-backed storage for chat session history."""
+
+import os
+import sqlite3
+import time
+from typing import Dict, List
+
+# Directory holding one SQLite file per chat session
+SESSIONS_DIR = os.path.join("data", "sessions")
+
+# Sessions untouched for longer than this are removed by `cleanup`
+SESSION_IDLE_TTL = 24 * 60 * 60
+
+
+class SessionStore:
+    """Persist chat messages to disk so they don't live in server memory."""
+
+    def __init__(self, base_dir: str = SESSIONS_DIR, idle_ttl: int = SESSION_IDLE_TTL):
+        self.base_dir = base_dir
+        self.idle_ttl = idle_ttl
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.base_dir, f"{session_id}.sqlite")
+
+    def _connect(self, session_id: str) -> sqlite3.Connection:
+        # A short-lived connection per call keeps the store safe to share
+        # between Streamlit's script threads.
+        conn = sqlite3.connect(self._path(session_id))
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT, idx INTEGER, role TEXT, content TEXT, "
+            "PRIMARY KEY (session_id, idx))"
+        )
+        return conn
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        """Append a message to the end of the session history."""
+        with self._connect(session_id) as conn:
+            conn.execute(
+                "INSERT INTO messages (session_id, idx, role, content) "
+                "SELECT ?, COALESCE(MAX(idx), -1) + 1, ?, ? FROM messages WHERE session_id = ?",
+                (session_id, role, content, session_id),
+            )
+        conn.close()
+
+    def tail(self, session_id: str, limit: int = 100) -> List[Dict[str, str]]:
+        """Return the last `limit` messages of the session, oldest first."""
+        if limit <= 0 or not os.path.exists(self._path(session_id)):
+            return []
+        conn = self._connect(session_id)
+        try:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? "
+                "ORDER BY idx DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def clear(self, session_id: str) -> None:
+        """Delete all stored messages for the session."""
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self) -> None:
+        """Remove session files that have been idle for longer than `idle_ttl`."""
+        cutoff = time.time() - self.idle_ttl
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            try:
+                if name.endswith(".sqlite") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                # The file may have been removed by another session meanwhile
+                pass
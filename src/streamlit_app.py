@@ -1,108 +1,281 @@
 import streamlit as st
+import asyncio
+import queue
+import threading
 import time
 import os
 import sys
-from config import MODELS
+import importlib.util
+import re
+import uuid
+from config import MODELS, MODEL_DETAILS_MD, MODEL_IDS, MODEL_PROMPT_BUDGETS, model_label
+from session_store import SessionStore
 
-# Attempt to import Cerebras SDK and specific error classes
-# Set up variables to capture debugging information
-import_error_details = ""
-sdk_import_paths = []
+# Default number of user/assistant exchanges sent to the API as context
+MAX_HISTORY_TURNS = 20
+
+# Stream deltas are coalesced until at least this many characters are buffered,
+# so each UI update (and websocket message) carries a meaningful chunk of text,
+# or until STREAM_FLUSH_INTERVAL seconds have passed so slow streams still show progress
+STREAM_BATCH_CHARS = 64
+STREAM_FLUSH_INTERVAL = 0.05
+
+# Number of stored messages shown in the chat transcript
+DISPLAY_HISTORY_LIMIT = 100
+
+# Session ids are uuid4 hex strings; anything else in the URL is ignored
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+@st.cache_data(show_spinner=False)
+def _probe_sdk():
+    """
+    Check whether the Cerebras SDK is installed and collect debugging information.
+    Only locates the package; the SDK itself is imported on first use by `_load_sdk`.
+    Cached so the sys.path probing runs once per process rather than on every rerun.
+    Returns (sdk_available, import_error_details, sdk_import_paths).
+    """
+    sdk_import_paths = []
 
-try:
     # Try to explicitly check if the cerebras module is available
-    import importlib.util
     spec = importlib.util.find_spec("cerebras")
     if spec is not None:
         sdk_import_paths.append(f"cerebras module found at: {spec.origin}")
     else:
         sdk_import_paths.append("cerebras module not found in sys.path")
-    
+
     # Capture Python's module search paths
     sdk_import_paths.append("Python sys.path contains:")
     for path in sys.path:
         sdk_import_paths.append(f"  - {path}")
-    
-    # Now try the actual import
-    from cerebras.cloud.sdk import Cerebras
-    # Try to import error classes directly from the main SDK package
-    # The error classes are likely defined within the main SDK package
-    from cerebras.cloud.sdk import APIError, APIConnectionError, AuthenticationError
-    CEREBRAS_SDK_AVAILABLE = True
-    sdk_import_paths.append("✅ Cerebras SDK import successful")
-except ImportError as e:
-    CEREBRAS_SDK_AVAILABLE = False
-    import_error_details = str(e)
-    sdk_import_paths.append(f"❌ Import Error: {import_error_details}")
-    
-    # Define dummy classes if SDK is not available, so the rest of the code doesn't break
-    class Cerebras: pass
-    class APIError(Exception): pass
-    class APIConnectionError(APIError): pass
-    class AuthenticationError(APIError): pass
+
+    # Locate the SDK package without importing it
+    try:
+        sdk_spec = importlib.util.find_spec("cerebras.cloud.sdk")
+        error = "No module named 'cerebras.cloud.sdk'"
+    except ImportError as e:
+        sdk_spec, error = None, str(e)
+    if sdk_spec is None:
+        sdk_import_paths.append(f"❌ Import Error: {error}")
+        return False, error, sdk_import_paths
+    sdk_import_paths.append("✅ Cerebras SDK found (imported on first request)")
+    return True, "", sdk_import_paths
+
+CEREBRAS_SDK_AVAILABLE, import_error_details, sdk_import_paths = _probe_sdk()
+
+@st.cache_resource(show_spinner=False)
+def _load_sdk():
+    """
+    Import and return the Cerebras SDK module.
+    Deferred until the first request so app start-up doesn't pay for the import.
+    """
+    import cerebras.cloud.sdk
+    return cerebras.cloud.sdk
 
 # --- Helper Functions (Actual API Interaction) ---
-def get_cebras_response(api_key, model_id, current_prompt, chat_history_for_api):
+# Sentinel placed on the chunk queue once the async stream has finished
+_STREAM_DONE = object()
+# Sentinel placed on the chunk queue when the reply was cut off by the token limit
+_STREAM_TRUNCATED = object()
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop():
     """
-    Function to get a response from the Cerebras API.
+    Return a background asyncio event loop shared by all sessions.
+    API streaming runs on this loop so network waits stay off the script thread.
     """
-    if not CEREBRAS_SDK_AVAILABLE:
-        return "Error: Cerebras SDK is not installed. Please run `pip install cerebras-cloud-sdk`."
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="cerebras-event-loop", daemon=True).start()
+    return loop
 
-    if not api_key:
-        return "Error: Cerebras API Key not provided. Please enter it in the sidebar."
+@st.cache_resource(show_spinner=False)
+def get_http_client():
+    """
+    Return the HTTP/2 client shared by every Cerebras client in the process.
+    Concurrent streams from all sessions are multiplexed over its connections.
+    """
+    import httpx
 
-    model_details = MODELS.get(model_id)
-    if not model_details:
-        return f"Error: Model '{model_id}' not found in local configuration."
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        http2=True,
+        timeout=30.0,
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_client(api_key):
+    """
+    Return an async Cerebras client for the given API key, cached across reruns
+    and backed by the shared HTTP/2 client.
+    """
+    return _load_sdk().AsyncCerebras(
+        api_key=api_key,
+        http_client=get_http_client(),
+        # The SDK's warm-up makes a blocking request from a throwaway sync client,
+        # which never warms the shared async connection
+        warm_tcp_connection=False,
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    """
+    Return the SQLite-backed chat history store shared by all sessions.
+    """
+    return SessionStore()
 
+async def _astream(client, model_id, messages_payload, chunk_queue):
+    """
+    Stream a chat completion and put its content on `chunk_queue`, coalescing
+    deltas into batches of at least STREAM_BATCH_CHARS characters (or whatever
+    has arrived once STREAM_FLUSH_INTERVAL has passed since the last put).
+    `_STREAM_TRUNCATED` is put if the reply hit the token limit.
+    Exceptions are forwarded through the queue; `_STREAM_DONE` is always put last.
+    If the task is cancelled, the SDK stream is closed so its connection is released.
+    """
+    stream = None
+    buf = []
+    buf_len = 0
+    last_put = time.monotonic()
     try:
-        client = Cerebras(api_key=api_key)
-
-        # Construct the messages payload for the API
-        # The API expects the full conversation history, including the latest prompt.
-        messages_payload = chat_history_for_api + [{"role": "user", "content": current_prompt}]
-
-        st.info(f"🚀 Sending request to Cerebras API with model: {model_id}...")
-        # For non-streaming:
-        # completion = client.chat.completions.create(
-        #     model=model_id,
-        #     messages=messages_payload,
-        #     # You might want to add other parameters like temperature, max_tokens, etc.
-        #     # max_tokens=model_details.get("tokens") # Example
-        # )
-        # return completion.choices[0].message.content
-
-        # For streaming:
-        full_response_content = ""
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=model_id,
             messages=messages_payload,
             stream=True,
-            # max_tokens=model_details.get("tokens") # Optional: manage max output tokens
         )
-        for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                content_part = chunk.choices[0].delta.content
-                yield content_part # Yield each part for streaming in Streamlit UI
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                buf.append(choice.delta.content)
+                buf_len += len(choice.delta.content)
+            if buf and (
+                buf_len >= STREAM_BATCH_CHARS
+                or choice.finish_reason
+                or time.monotonic() - last_put >= STREAM_FLUSH_INTERVAL
+            ):
+                chunk_queue.put("".join(buf))
+                buf.clear()
+                buf_len = 0
+                last_put = time.monotonic()
+            if choice.finish_reason == "length":
+                chunk_queue.put(_STREAM_TRUNCATED)
+        # Flush anything left if the stream ended without a finish_reason
+        if buf:
+            chunk_queue.put("".join(buf))
+    except asyncio.CancelledError:
+        if stream is not None:
+            await stream.close()
+        raise
+    except Exception as e:
+        chunk_queue.put(e)
+    finally:
+        chunk_queue.put(_STREAM_DONE)
+
+def validate_request(api_key, model_id):
+    """
+    Check that a request to the Cerebras API can be made.
+    Returns an error message, or None if the request is valid.
+    """
+    if not CEREBRAS_SDK_AVAILABLE:
+        return "Error: Cerebras SDK is not installed. Please run `pip install cerebras-cloud-sdk`."
+
+    try:
+        _load_sdk()
+    except ImportError as e:
+        return f"Error: Cerebras SDK could not be imported. Details: {e}"
 
-    except AuthenticationError:
+    if not api_key:
+        return "Error: Cerebras API Key not provided. Please enter it in the sidebar."
+
+    # The selectbox only offers MODEL_IDS, so this only fails on a programming error
+    if model_id not in MODELS:
+        return f"Error: Model '{model_id}' not found in local configuration."
+
+    return None
+
+def describe_error(e):
+    """
+    Turn an exception raised while streaming into a user-facing error message.
+    """
+    sdk = _load_sdk()
+    if isinstance(e, sdk.AuthenticationError):
         return "Error: Authentication failed. Please check your Cerebras API Key."
-    except APIConnectionError as e:
+    if isinstance(e, sdk.APIConnectionError):
         return f"Error: Could not connect to Cerebras API. Details: {e}"
-    except APIError as e:
+    if isinstance(e, sdk.APIError):
         return f"Error: Cerebras API returned an error. Status: {e.status_code}, Message: {e.message}"
-    except Exception as e:
-        return f"An unexpected error occurred: {e}"
+    return f"An unexpected error occurred: {e}"
+
+def _approx_tokens(text):
+    """
+    Rough token count (about 4 characters per token) used to budget the context window.
+    """
+    return (len(text) + 3) // 4
+
+def trim_to_budget(history, current_prompt, budget):
+    """
+    Drop the oldest messages from `history` until it and `current_prompt`
+    fit within `budget` approximate tokens. The prompt itself is always kept.
+    """
+    used = _approx_tokens(current_prompt)
+    kept = 0
+    for message in reversed(history):
+        used += _approx_tokens(message["content"])
+        if used > budget:
+            break
+        kept += 1
+    return history[len(history) - kept:]
+
+def get_cebras_response(api_key, model_id, current_prompt, chat_history_for_api, max_history_turns=MAX_HISTORY_TURNS):
+    """
+    Stream a response from the Cerebras API, yielding each content part.
+    Only the last `max_history_turns` user/assistant exchanges are sent as context,
+    further trimmed to fit the model's context window.
+    Call `validate_request` first; API errors are raised to the caller.
+    """
+    client = get_client(api_key)
+
+    # Construct the messages payload for the API
+    # Keep a sliding window of the most recent exchanges (user + assistant pairs)
+    # so the payload doesn't grow without bound over a long session.
+    trimmed_history = chat_history_for_api[-2 * max_history_turns:] if max_history_turns > 0 else []
+    # Drop the oldest messages that would overflow the context window, rather than
+    # letting the API reject the request
+    trimmed_history = trim_to_budget(trimmed_history, current_prompt, MODEL_PROMPT_BUDGETS[model_id])
+    messages_payload = trimmed_history + [{"role": "user", "content": current_prompt}]
+
+    st.info(f"🚀 Sending request to Cerebras API with model: {model_id}...")
+
+    # Run the async stream on the background loop and bridge it back through a queue
+    chunk_queue = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        _astream(client, model_id, messages_payload, chunk_queue),
+        get_event_loop(),
+    )
+    truncated = False
+    try:
+        while (content_part := chunk_queue.get()) is not _STREAM_DONE:
+            if content_part is _STREAM_TRUNCATED:
+                truncated = True
+                continue
+            if isinstance(content_part, Exception):
+                raise content_part
+            yield content_part # Yield each part for streaming in Streamlit UI
+        if truncated:
+            st.warning("⚠️ The reply was cut off because it reached the model's token limit.")
+    finally:
+        # Stop the API stream if the consumer goes away early; the caller closes
+        # the generator explicitly so this runs as soon as it stops reading
+        future.cancel()
 
 # --- Streamlit App ---
 st.set_page_config(page_title="Cerebras Chatbot", page_icon="🤖")
 
-st.write("Python Path:", sys.executable)
-st.write("Python Version:", sys.version)
-
-# Display detailed import debugging information
-st.expander("🔍 SDK Import Debug Information").write("\n".join(sdk_import_paths))
+# Display detailed import debugging information (only when DEBUG_SDK_IMPORTS is set)
+if os.getenv("DEBUG_SDK_IMPORTS"):
+    st.write("Python Path:", sys.executable)
+    st.write("Python Version:", sys.version)
+    st.expander("🔍 SDK Import Debug Information").write("\n".join(sdk_import_paths))
 
 st.title("🤖 Cerebras Powered Chatbot")
 
@@ -124,11 +297,12 @@ with st.sidebar:
 
     # API Key Input
     # You can also set this as an environment variable CEREBRAS_API_KEY
-    env_api_key = os.getenv("CEREBRAS_API_KEY")
+    # The environment is read once per session rather than on every rerun
+    env_api_key = st.session_state.setdefault("_env_api_key", os.getenv("CEREBRAS_API_KEY") or "")
     cebras_api_key = st.text_input(
         "🔑 Cerebras API Key",
         type="password",
-        value=env_api_key if env_api_key else "",
+        value=env_api_key,
         help="Enter your Cerebras API key. You can also set the CEREBRAS_API_KEY environment variable."
     )
     if not cebras_api_key and not env_api_key:
@@ -137,33 +311,59 @@ with st.sidebar:
         cebras_api_key = env_api_key # Use env var if input is cleared but env var exists
 
     # Model Selection
-    model_options = list(MODELS.keys())
     selected_model_id = st.selectbox(
         "🧠 Select Model",
-        options=model_options,
-        format_func=lambda model_id: MODELS[model_id]["name"],
+        options=MODEL_IDS,
+        format_func=model_label,
         help="Choose the Cerebras model you want to interact with."
     )
 
+    # Context window size
+    max_history_turns = st.slider(
+        "🧵 History Turns Sent",
+        min_value=0,
+        max_value=50,
+        value=MAX_HISTORY_TURNS,
+        help="Number of previous user/assistant exchanges sent to the model as context."
+    )
+
     st.markdown("---")
     if selected_model_id:
-        model_info = MODELS[selected_model_id]
-        st.markdown(f"**Model Details:**")
-        st.markdown(f"- **Name:** {model_info['name']}")
-        st.markdown(f"- **Max Tokens (Context):** {model_info['tokens']}")
-        st.markdown(f"- **Developer:** {model_info['developer']}")
+        st.markdown(MODEL_DETAILS_MD[selected_model_id])
     st.markdown("---")
     st.markdown("ℹ️ This application uses the `cerebras.cloud.sdk`.")
 
 
 # --- Chat Interface ---
 
-# Initialize chat history in session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Chat history is persisted in the session store; session_state only keeps the session id
+# and a bounded window of recent messages, loaded from the store once per browser session.
+# The session id is kept in the URL so a reload picks the stored conversation back up.
+store = get_session_store()
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("session", "")
+    if not SESSION_ID_PATTERN.fullmatch(session_id): # Also keeps arbitrary paths out of the store
+        session_id = uuid.uuid4().hex
+        st.query_params["session"] = session_id
+        store.cleanup() # Drop sessions that have been idle past their TTL
+    st.session_state.session_id = session_id
+session_id = st.session_state.session_id
+if "history" not in st.session_state:
+    st.session_state.history = store.tail(session_id, limit=DISPLAY_HISTORY_LIMIT)
+
+def add_message(role, content):
+    """Persist a message and append it to the in-memory display window."""
+    store.append(session_id, role, content)
+    st.session_state.history.append({"role": role, "content": content})
+    del st.session_state.history[:-DISPLAY_HISTORY_LIMIT]
+
+def clear_chat_history(session_id):
+    """Button callback: drop the stored and displayed history before the next run renders."""
+    get_session_store().clear(session_id)
+    st.session_state.history = []
 
 # Display previous messages
-for message in st.session_state.messages:
+for message in st.session_state.history:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
@@ -174,8 +374,9 @@ if prompt := st.chat_input("What would you like to ask?"):
     elif not selected_model_id:
         st.error("🤔 Please select a model from the sidebar.")
     else:
-        # Add user message to chat history and display it
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        # Fetch the history *before* the current prompt, then store and display the prompt
+        chat_history = list(st.session_state.history)
+        add_message("user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
 
@@ -184,34 +385,37 @@ if prompt := st.chat_input("What would you like to ask?"):
             message_placeholder = st.empty()
             full_response_content = ""
 
-            # Prepare chat history for the API call (current session_state.messages is suitable)
-            # The API call itself will receive the prompt as part of the messages list
-            try:
-                response_stream = get_cebras_response(
-                    cebras_api_key,
-                    selected_model_id,
-                    prompt, # Pass current prompt separately for clarity in function
-                    st.session_state.messages[:-1] # Pass history *before* current prompt
-                )
-
-                if isinstance(response_stream, str): # Indicates an error string was returned
-                    full_response_content = response_stream
-                    message_placeholder.error(full_response_content)
-                else: # It's a generator for streaming
-                    for chunk_content in response_stream:
-                        full_response_content += chunk_content
-                        message_placeholder.markdown(full_response_content + "▌")
-                    message_placeholder.markdown(full_response_content)
-
-            except Exception as e: # Catch any other unexpected errors from the generator
-                full_response_content = f"An unexpected error occurred during streaming: {str(e)}"
+            error_message = validate_request(cebras_api_key, selected_model_id)
+            if error_message:
+                full_response_content = error_message
                 message_placeholder.error(full_response_content)
+            else:
+                # The API call itself will receive the prompt as part of the messages list
+                try:
+                    response_stream = get_cebras_response(
+                        cebras_api_key,
+                        selected_model_id,
+                        prompt, # Pass current prompt separately for clarity in function
+                        chat_history,
+                        max_history_turns
+                    )
+                    # st.write_stream handles incremental rendering and the cursor,
+                    # and returns the concatenated response
+                    try:
+                        full_response_content = message_placeholder.write_stream(response_stream)
+                    finally:
+                        # Close right away on stop/rerun so the API stream is cancelled now,
+                        # not whenever the previous run's module is garbage collected
+                        response_stream.close()
+
+                except Exception as e: # API and connection errors are raised from the generator
+                    full_response_content = describe_error(e)
+                    message_placeholder.error(full_response_content)
 
         # Add assistant response (or error) to chat history
-        st.session_state.messages.append({"role": "assistant", "content": full_response_content})
+        add_message("assistant", full_response_content)
 
 # Add a button to clear chat history
-if st.sidebar.button("Clear Chat History"):
-    st.session_state.messages = []
-    st.rerun()
+# The callback runs before the automatic rerun, so no explicit st.rerun() is needed
+st.sidebar.button("Clear Chat History", on_click=clear_chat_history, args=(session_id,))
 